@@ -1,10 +1,12 @@
 import os
 import logging
-from flask import Flask, render_template, request, jsonify, send_file
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, render_template, request, jsonify, Response
 from scraper import ImageScraper, FilterRule
 import zipfile
-from io import BytesIO
-from PIL import Image
 from urllib.parse import urlparse
 
 # Configure logging
@@ -145,6 +147,115 @@ def scrape():
         logger.error(f"Unexpected error: {str(e)}")
         return jsonify({'error': 'An unexpected error occurred'}), 500
 
+class _ZipChunkBuffer:
+    """Minimal unseekable file-like object that hands written chunks back"""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+def stream_zip(folder_path):
+    """Yield zip archive bytes as each file is compressed
+
+    Writing through an unseekable buffer keeps memory constant instead of
+    holding the whole archive, and the first bytes leave the server while
+    later files are still being compressed. Folders with enough entries
+    compress across a thread pool instead.
+    """
+    # DirEntry caches the stat result, so this is one syscall per entry
+    # instead of the listdir + isfile pair
+    with os.scandir(folder_path) as entries:
+        filenames = [
+            entry.name for entry in entries
+            if entry.is_file(follow_symlinks=False)
+        ]
+    # Pool setup is not worth it for a handful of files
+    if len(filenames) < 4:
+        yield from _stream_zip_serial(folder_path, filenames)
+    else:
+        yield from _stream_zip_parallel(folder_path, filenames)
+
+# Already entropy-coded formats gain nothing from DEFLATE, so store them
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+
+def _zip_method(filename):
+    """Pick the zip compression method for a file by extension"""
+    if os.path.splitext(filename)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def _stream_zip_serial(folder_path, filenames):
+    """Single-threaded zip stream via zipfile"""
+    buffer = _ZipChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for filename in filenames:
+            zf.write(os.path.join(folder_path, filename), filename,
+                     compress_type=_zip_method(filename), compresslevel=1)
+            yield from buffer.drain()
+    # Central directory written on close
+    yield from buffer.drain()
+
+def _compress_entry(file_path):
+    """Read and compress one file, returning what the zip records need"""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if _zip_method(file_path) == zipfile.ZIP_STORED:
+        return zlib.crc32(data), len(data), data, 0
+    compressor = zlib.compressobj(1, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    return zlib.crc32(data), len(data), compressed, 8
+
+def _stream_zip_parallel(folder_path, filenames):
+    """Deflate entries across a thread pool and stitch the archive manually
+
+    zlib releases the GIL, so worker threads compress files on separate
+    cores while this generator writes local headers, payloads and the
+    central directory in order (the layout zipfile itself produces).
+    """
+    now = time.localtime()
+    dos_time = (now.tm_hour << 11) | (now.tm_min << 5) | (now.tm_sec // 2)
+    dos_date = ((now.tm_year - 1980) << 9) | (now.tm_mon << 5) | now.tm_mday
+
+    offset = 0
+    central = []
+    with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 2, len(filenames))) as pool:
+        results = pool.map(
+            _compress_entry,
+            [os.path.join(folder_path, filename) for filename in filenames])
+        for filename, (crc, size, payload, method) in zip(filenames, results):
+            name = filename.encode('utf-8')
+            # Local file header: UTF-8 names, sizes known up front
+            header = struct.pack(
+                '<4s5H3I2H', b'PK\x03\x04', 20, 0x0800, method,
+                dos_time, dos_date, crc, len(payload), size, len(name), 0)
+            yield header + name
+            yield payload
+            central.append((name, crc, len(payload), size, method, offset))
+            offset += len(header) + len(name) + len(payload)
+
+    central_start = offset
+    central_size = 0
+    for name, crc, payload_size, size, method, entry_offset in central:
+        record = struct.pack(
+            '<4s6H3I5H2I', b'PK\x01\x02', 20, 20, 0x0800, method,
+            dos_time, dos_date, crc, payload_size, size,
+            len(name), 0, 0, 0, 0, 0, entry_offset) + name
+        central_size += len(record)
+        yield record
+
+    yield struct.pack(
+        '<4s4H2IH', b'PK\x05\x06', 0, 0, len(central), len(central),
+        central_size, central_start, 0)
+
 @app.route('/download/<folder_name>', methods=['GET'])
 def download_zip(folder_name):
     try:
@@ -155,23 +266,12 @@ def download_zip(folder_name):
         if not os.path.exists(folder_path):
             return jsonify({'error': 'Folder not found'}), 404
 
-        memory_file = BytesIO()
-        try:
-            with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for filename in os.listdir(folder_path):
-                    file_path = os.path.join(folder_path, filename)
-                    if os.path.isfile(file_path):
-                        zf.write(file_path, filename)
-        except Exception as e:
-            logger.error(f"Error creating zip file: {str(e)}")
-            return jsonify({'error': 'Failed to create zip file'}), 500
-
-        memory_file.seek(0)
-        return send_file(
-            memory_file,
+        return Response(
+            stream_zip(folder_path),
             mimetype='application/zip',
-            as_attachment=True,
-            download_name=f'{folder_name}_banners.zip'
+            headers={
+                'Content-Disposition': f'attachment; filename={folder_name}_banners.zip'
+            }
         )
 
     except Exception as e:
@@ -1,19 +1,100 @@
 import os
+import hashlib
 import logging
+import mmap
+import re
+import shutil
+import socket
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from urllib.parse import urljoin, urlparse
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from PIL import Image
 import io
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException, Timeout, ConnectionError
+from urllib3.util.retry import Retry
+
+try:
+    from requests_cache import CachedSession
+    HAS_REQUESTS_CACHE = True
+except ImportError:
+    HAS_REQUESTS_CACHE = False
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+    HAS_SELECTOLAX = True
+except ImportError:
+    HAS_SELECTOLAX = False
 
 # Configure logging with more detail
+# INFO by default; per-image diagnostics sit at DEBUG and cost nothing
+# unless that level is switched on
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+# Attribute values split into comparable tokens on whitespace, '-' and '_'
+_TOKEN_SPLIT_RE = re.compile(r'[\s_\-]+')
+
+# srcset entries: a URL followed by a width (800w) or density (2x) descriptor
+_SRCSET_RE = re.compile(r'([^\s,]+)\s+(\d+(?:\.\d+)?)([wx])')
+
+# URL markers of shrunken previews that usually have a full-size srcset sibling
+_PREVIEW_RE = re.compile(r'_(?:100x|thumb|small|mini)', re.I)
+
+# min-width breakpoint inside a <source media="..."> query
+_MIN_WIDTH_RE = re.compile(r'min-width\s*:\s*(\d+)')
+
+# Prefer the C-backed lxml parser; fall back to the stdlib one
+try:
+    import lxml  # noqa: F401
+    DEFAULT_PARSER = 'lxml'
+except ImportError:
+    DEFAULT_PARSER = 'html.parser'
+
+# When no term filters are active, only the image-bearing tags matter and
+# the rest of the document can be skipped at parse time. <source> must be
+# in the list: nesting among retained tags survives the strainer, and a
+# src-less in-picture img has no URL of its own - get_image_url resolves
+# it from the picture's source tags, so losing them would drop the image
+_IMAGE_STRAINER = SoupStrainer(['img', 'picture', 'source'])
+
+
+class _NodeAdapter:
+    """bs4-compatible facade over a selectolax node
+
+    Exposes just the surface get_image_url touches (.get, .name, .parent,
+    find_all('source')) so the URL-extraction code stays parser-agnostic.
+    Only used on the unfiltered path: term matching keys its caches on
+    element identity, which fresh adapter objects would defeat.
+    """
+
+    __slots__ = ('_node',)
+
+    def __init__(self, node):
+        self._node = node
+
+    def get(self, name, default=None):
+        value = self._node.attributes.get(name, default)
+        # selectolax stores value-less attributes as None
+        return default if value is None else value
+
+    @property
+    def name(self):
+        return self._node.tag
+
+    @property
+    def parent(self):
+        parent = self._node.parent
+        return _NodeAdapter(parent) if parent is not None else None
+
+    def find_all(self, name):
+        return [_NodeAdapter(node) for node in self._node.css(name)]
+
 class ScraperError(Exception):
     """Base exception for scraper errors"""
     pass
@@ -27,6 +108,15 @@ class ImageProcessingError(ScraperError):
     pass
 
 class FilterRule:
+    # Attributes whose values participate in term matching
+    WATCHED_ATTRIBUTES = ('id', 'name', 'role', 'data-type', 'data-section-type')
+
+    # How many ancestor levels above the image tag are inspected
+    PARENT_DEPTH = 4
+
+    # Cap on distinct interned token values (bounds memory on hostile pages)
+    INTERN_LIMIT = 10000
+
     def __init__(self, include_terms=None, exclude_terms=None, min_width=100, min_height=100, media_types=None):
         self.include_terms = [term.lower().strip() for term in (include_terms or [])]
         self.exclude_terms = [term.lower().strip() for term in (exclude_terms or [])]
@@ -43,119 +133,266 @@ class FilterRule:
             'media', 'media-image', 'media-content'
         ]
 
+        # Precomputed term sets so matching an image is a handful of hashed
+        # set operations instead of string scans: single-token terms check
+        # plain membership against the image's token set, compound
+        # (multi-word) terms check subset-ness
+        self._include_set, self._compound_include = self._build_term_sets(self.include_terms)
+        self._exclude_set, self._compound_exclude = self._build_term_sets(self.exclude_terms)
+        self._default_set, self._compound_default = self._build_term_sets(self.default_terms)
+
+        # Canonical token values: pages repeat the same class names across
+        # tags, so sharing one string object per distinct value cuts
+        # memory and lets set hashing short-circuit on identity. Preloaded
+        # with the terms so the common comparisons hit shared objects.
+        self._intern = {}
+        for term in (*self.include_terms, *self.exclude_terms, *self.default_terms):
+            self._intern[term] = term
+            for part in term.split():
+                self._intern[part] = part
+
+        # Per-element token cache keyed by id(element); images in the same
+        # gallery share ancestors, so each ancestor is tokenized only once
+        self._attr_cache = {}
+        # Memoized ancestor-chain unions keyed by (id(element), depth), so
+        # sibling images reuse their shared parent chain outright
+        self._chain_cache = {}
+
+        # Per-image term predicate, specialized once for these term lists
+        self._match_fn = self._build_match_fn()
+
+    @staticmethod
+    def _build_term_sets(terms):
+        """Split a term list into a frozenset of single-token terms and a
+        list of (term, parts) pairs for compound terms"""
+        singles = frozenset(term for term in terms if ' ' not in term)
+        compounds = [(term, frozenset(term.split())) for term in terms if ' ' in term]
+        return singles, compounds
+
+    def _intern_token(self, token):
+        """Return the canonical shared instance of a token value"""
+        interned = self._intern.get(token)
+        if interned is not None:
+            return interned
+        if len(self._intern) < self.INTERN_LIMIT:
+            self._intern[token] = token
+        return token
+
+    def _element_tokens(self, element):
+        """Tokenize a single element's name, classes and attributes (memoized)
+
+        Every token is lowercased exactly once here and interned so equal
+        values share one string object; downstream matching relies on the
+        lowercasing and never lowercases again.
+        """
+        cached = self._attr_cache.get(id(element))
+        if cached is not None:
+            return cached
+
+        intern = self._intern_token
+        tokens = set()
+
+        # Add tag name (HTML parsers already lowercase it)
+        tokens.add(intern(element.name))
+
+        # Handle classes
+        classes = element.get('class')
+        if classes:
+            # Add the full class string first (preserve exact matches)
+            if isinstance(classes, list):
+                full_class = ' '.join(classes).lower()
+            else:
+                full_class = classes.lower()
+            tokens.add(intern(full_class))
+
+            # Add individual classes plus their '-'/'_'-separated words, so
+            # a term like 'banner' still hits 'main-banner'
+            tokens.update(intern(part) for part in full_class.split())
+            tokens.update(intern(part) for part in _TOKEN_SPLIT_RE.split(full_class) if part)
+
+        # Add other attributes
+        for attr in self.WATCHED_ATTRIBUTES:
+            value = element.get(attr)
+            if value:
+                value = value.lower()
+                tokens.add(intern(value))
+                tokens.update(intern(part) for part in _TOKEN_SPLIT_RE.split(value) if part)
+
+        tokens = frozenset(tokens)
+        self._attr_cache[id(element)] = tokens
+        return tokens
+
+    def _chain_tokens(self, element, depth):
+        """Union of an element's tokens with up to depth ancestors (memoized)
+
+        Recursing through the cache means a gallery of N sibling images
+        tokenizes and unions their shared parent chain once, not N times.
+        """
+        key = (id(element), depth)
+        cached = self._chain_cache.get(key)
+        if cached is not None:
+            return cached
+
+        tokens = self._element_tokens(element)
+        parent = element.parent
+        if depth > 0 and parent is not None:
+            # libxml2 nests in-picture imgs inside synthetic <source>
+            # containers; those must not eat into the ancestor window
+            next_depth = depth if parent.name == 'source' else depth - 1
+            tokens = tokens | self._chain_tokens(parent, next_depth)
+
+        self._chain_cache[key] = tokens
+        return tokens
+
+    def _iter_attrs(self, img_tag):
+        """Yield memoized token sets level by level, the image tag first
+
+        Lets callers short-circuit on an early hit without paying for the
+        full ancestor-chain union; _extract_all_attributes remains the
+        materialized form.
+        """
+        element = img_tag
+        remaining = self.PARENT_DEPTH + 1
+        while element is not None and remaining > 0:
+            yield self._element_tokens(element)
+            # Synthetic <source> containers (see _chain_tokens) do not
+            # consume an ancestor level
+            if element.name != 'source':
+                remaining -= 1
+            element = element.parent
+
     def _extract_all_attributes(self, img_tag):
         """Extract all relevant attributes from the image and its parent elements"""
         try:
-            all_attributes = set()
-            current = img_tag
-            depth = 0
-
-            while current and depth < 5:
-                # Add tag name
-                all_attributes.add(current.name.lower())
-
-                # Handle classes
-                if current.get('class'):
-                    # Add the full class string first (preserve exact matches)
-                    if isinstance(current.get('class'), list):
-                        full_class = ' '.join(current.get('class')).lower()
-                    else:
-                        full_class = current.get('class').lower()
-                    all_attributes.add(full_class)
-
-                    # Add individual classes
-                    classes = full_class.split()
-                    all_attributes.update(classes)
-
-                # Add other attributes
-                for attr in ['id', 'name', 'role', 'data-type', 'data-section-type']:
-                    if current.get(attr):
-                        all_attributes.add(current[attr].lower())
-
-                # Move to parent
-                current = current.parent
-                depth += 1
-
-            return all_attributes
+            return self._chain_tokens(img_tag, self.PARENT_DEPTH)
         except Exception as e:
             logger.error(f"Error extracting attributes: {str(e)}")
             raise ScraperError(f"Failed to extract attributes: {str(e)}")
 
-    def matches(self, img_tag, dimensions, all_attributes=None):
-        """Check if an image matches the filtering rules"""
-        try:
-            width, height = dimensions
+    def matches_dimensions(self, dimensions):
+        """Check an image's real dimensions against the rule minima"""
+        width, height = dimensions
+        return width >= self.min_width and height >= self.min_height
 
-            # Skip tiny images
-            if width < self.min_width or height < self.min_height:
-                return False, []
+    def _build_match_fn(self):
+        """Specialize the per-image term predicate for this rule
+
+        The term lists are fixed after __init__, so the branches deciding
+        which checks apply are resolved once here rather than per image;
+        each specialization closes over exactly the sets it needs.
+        """
+        # No terms at all: accept everything outright
+        if not self.include_terms and not self.exclude_terms:
+            return lambda all_attributes: (True, ['unfiltered'])
+
+        exclude_set = self._exclude_set
+        compound_exclude = self._compound_exclude
 
-            # If no include terms and no exclude terms are set, accept all images
-            if not self.include_terms and not self.exclude_terms:
-                # Still return a default term for consistency
+        def excluded(all_attributes):
+            # A single hashed intersection plus subset checks for any
+            # compound terms
+            return exclude_set & all_attributes or any(
+                parts <= all_attributes for _, parts in compound_exclude)
+
+        # Exclude-only rules accept whatever is not excluded and never
+        # touch the include/default term machinery
+        if not self.include_terms:
+            def match_exclude_only(all_attributes):
+                if excluded(all_attributes):
+                    logger.debug("Excluded by term")
+                    return False, []
                 return True, ['unfiltered']
+            return match_exclude_only
 
-            # Extract all attributes from image and parents if not provided
-            if all_attributes is None:
-                all_attributes = self._extract_all_attributes(img_tag)
+        include_terms = self.include_terms
+        include_set = self._include_set
+        compound_include = self._compound_include
+        default_terms = self.default_terms
+        default_set = self._default_set
+        compound_default = self._compound_default
 
-            # Debug logging
-            logger.debug(f"Checking image with attributes: {all_attributes}")
-            logger.debug(f"Include terms: {self.include_terms}")
+        def match(all_attributes):
+            if logger.isEnabledFor(logging.DEBUG):
+                # The attribute set can be large; skip its repr entirely
+                # unless DEBUG output is actually emitted
+                logger.debug("Checking image with attributes: %s", all_attributes)
+                logger.debug("Include terms: %s", include_terms)
 
             # Check exclude terms first
-            if self.exclude_terms:
-                for term in self.exclude_terms:
-                    if self._term_matches(term, all_attributes):
-                        logger.debug(f"Excluded by term: {term}")
-                        return False, []
-
-            # Check custom include terms
-            matched_terms = []
-            if self.include_terms:
-                for term in self.include_terms:
-                    if self._term_matches(term, all_attributes):
-                        logger.debug(f"Matched include term: {term}")
-                        matched_terms.append(term)
-
-            # If no custom terms matched or no custom terms provided, check default terms
-            if not matched_terms and self.include_terms:  # Only check default terms if include_terms were specified
-                for term in self.default_terms:
-                    if self._term_matches(term, all_attributes):
-                        logger.debug(f"Matched default term: {term}")
-                        matched_terms.append(term)
-
-            # Accept if any terms matched or if no filters are set
-            return bool(matched_terms) or not self.include_terms, matched_terms or ['unfiltered']
+            if excluded(all_attributes):
+                logger.debug("Excluded by term")
+                return False, []
+
+            # Check custom include terms (re-walking the term list keeps the
+            # reported order stable)
+            include_hits = include_set & all_attributes
+            matched_terms = [term for term in include_terms if term in include_hits]
+            matched_terms += [
+                term for term, parts in compound_include
+                if parts <= all_attributes
+            ]
+            if matched_terms:
+                logger.debug("Matched include terms: %s", matched_terms)
+                return True, matched_terms
+
+            # No custom terms matched; fall back to the default terms
+            default_hits = default_set & all_attributes
+            matched_terms = [term for term in default_terms if term in default_hits]
+            matched_terms += [
+                term for term, parts in compound_default
+                if parts <= all_attributes
+            ]
+            if matched_terms:
+                logger.debug("Matched default terms: %s", matched_terms)
+                return True, matched_terms
+
+            return False, ['unfiltered']
+
+        return match
 
+    def matches_attributes(self, all_attributes):
+        """Run the term checks against an attribute-chain token set
+
+        Needs no image bytes, so it can run before any download. The
+        tokens must come from _extract_all_attributes so they are already
+        lowercased. Returns (accepted, matched_terms).
+        """
+        try:
+            return self._match_fn(all_attributes)
         except Exception as e:
             logger.error(f"Error in filter matching: {str(e)}")
             raise ScraperError(f"Failed to apply filters: {str(e)}")
 
-    def _term_matches(self, term, all_attributes):
-        """Check if a term matches any attribute"""
-        try:
-            term = term.lower().strip()
-
-            # First try exact match
-            if term in all_attributes:
-                logger.debug(f"Exact match found for term: {term}")
-                return True
+    def matches(self, img_tag, dimensions, all_attributes=None):
+        """Check if an image matches the filtering rules (size and terms)
 
-            # If no exact match, try matching individual parts
-            term_parts = term.split()
-            for attr in all_attributes:
-                # For compound terms, all parts must match
-                if len(term_parts) > 1:
-                    attr_parts = attr.split()
-                    if all(tp in attr_parts for tp in term_parts):
-                        logger.debug(f"Compound match found for term: {term} in attribute: {attr}")
-                        return True
+        Combined convenience form; the scrape pipeline calls the dimension
+        and attribute halves separately, since terms are checked before
+        download and dimensions only after bytes arrive. Without a
+        precomputed attribute set, ancestor levels are inspected lazily:
+        an exclude hit at any level rejects right there, and a rule with
+        no exclude terms accepts on the first include hit - frequently at
+        the image tag itself, skipping the parent walk entirely.
+        """
+        if not self.matches_dimensions(dimensions):
+            return False, []
+        if all_attributes is not None or \
+                not (self.include_terms or self.exclude_terms):
+            return self.matches_attributes(all_attributes)
 
-            return False
-        except Exception as e:
-            logger.error(f"Error matching terms: {str(e)}")
-            raise ScraperError(f"Failed to match terms: {str(e)}")
+        seen = frozenset()
+        for level_tokens in self._iter_attrs(img_tag):
+            # A single-token exclude hit ends the walk immediately;
+            # compound excludes can span levels and are re-checked below
+            if self._exclude_set & level_tokens:
+                logger.debug("Excluded by term")
+                return False, []
+            seen |= level_tokens
+            if not self.exclude_terms:
+                accepted, matched_terms = self.matches_attributes(seen)
+                if accepted:
+                    return True, matched_terms
+        return self.matches_attributes(seen)
 
 class ImageScraper:
     def __init__(self):
@@ -167,122 +404,389 @@ class ImageScraper:
         }
         self.allowed_formats = ['jpg', 'jpeg', 'png', 'gif', 'webp']
         self.minimal_size = 10  # Minimal size in pixels when no filters are applied
+        self.max_workers = 16  # Concurrent image downloads
+
+        # Shared session so TCP/TLS connections are reused across downloads.
+        # With requests-cache installed, re-scraping the same page (users
+        # experimenting with filter settings) skips the network entirely.
+        if HAS_REQUESTS_CACHE:
+            self.session = CachedSession(
+                'scraper_cache',
+                expire_after=3600,
+                allowable_codes=(200, 206),
+                # Range probes and full fetches hit the same URL; keying on
+                # the Range header keeps their cache entries apart
+                match_headers=['Range'],
+            )
+        else:
+            self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        # Transient gateway errors retry with a short backoff rather than
+        # losing the image outright
+        retry = Retry(total=2, backoff_factor=0.3,
+                      status_forcelist=[502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32,
+                              max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # Small pool so disk writes overlap with downloads and each other
+        self._writer_pool = ThreadPoolExecutor(max_workers=4)
+
+        # Parsed candidates per page URL; a page revalidated with a
+        # conditional GET skips the transfer and the parse on re-scrape
+        self._page_cache = {}
+        self._page_cache_size = 64
+
+    # Tag attributes that may carry the image URL, in preference order
+    URL_ATTRIBUTES = ('srcset', 'data-srcset', 'src', 'data-src',
+                      'data-original', 'data-lazy-src')
 
     def get_image_url(self, img_tag):
         """Extract highest quality image URL from various tag attributes"""
         def parse_srcset(srcset_str):
-            """Parse srcset string and return the highest quality image URL"""
-            try:
-                best_url = None
-                max_width = 0
-                max_pixel_ratio = 0
-
-                for srcset_item in srcset_str.split(','):
-                    parts = srcset_item.strip().split()
-                    if len(parts) >= 2:
-                        url = parts[0]
-                        descriptor = parts[1]
-
-                        # Handle width descriptors (e.g., 800w)
-                        if descriptor.endswith('w'):
-                            try:
-                                width = int(descriptor[:-1])
-                                if width > max_width:
-                                    max_width = width
-                                    best_url = url
-                            except ValueError:
-                                continue
-
-                        # Handle pixel density descriptors (e.g., 2x)
-                        elif descriptor.endswith('x'):
-                            try:
-                                ratio = float(descriptor[:-1])
-                                if ratio > max_pixel_ratio:
-                                    max_pixel_ratio = ratio
-                                    best_url = url
-                            except ValueError:
-                                continue
-
-                # Prefer width-based URLs over pixel ratio-based ones
-                return best_url
-            except Exception as e:
-                logger.warning(f"Error parsing srcset: {str(e)}")
-                return None
+            """Parse srcset string and return the highest quality image URL
+
+            A single precompiled-regex pass pulls out every URL/descriptor
+            pair; the match guarantees a numeric descriptor, so no
+            per-item split/strip/try dance is needed.
+            """
+            best_url = None
+            max_width = 0.0
+            max_pixel_ratio = 0.0
+
+            for match in _SRCSET_RE.finditer(srcset_str):
+                url, value, kind = match.groups()
+                # Width descriptors (e.g. 800w)
+                if kind == 'w':
+                    width = float(value)
+                    if width > max_width:
+                        max_width = width
+                        best_url = url
+                # Pixel density descriptors (e.g. 2x)
+                else:
+                    ratio = float(value)
+                    if ratio > max_pixel_ratio:
+                        max_pixel_ratio = ratio
+                        best_url = url
+
+            return best_url
 
         # Try different attributes where image URL might be stored
-        for attr in ['srcset', 'data-srcset', 'src', 'data-src', 'data-original', 'data-lazy-src']:
+        for attr in self.URL_ATTRIBUTES:
             url = img_tag.get(attr, '')
             if url:
                 # Handle srcset attributes
                 if 'srcset' in attr:
                     high_quality_url = parse_srcset(url)
                     if high_quality_url:
-                        return high_quality_url.strip()
+                        # Regex-extracted URLs cannot carry whitespace
+                        return high_quality_url
                 else:
                     # For regular URLs, check if it's a small preview (contains dimensions)
-                    if any(x in url.lower() for x in ['_100x', '_thumb', '_small', '_mini']):
+                    if _PREVIEW_RE.search(url):
                         # Try to find a srcset with better quality
                         for srcset_attr in ['srcset', 'data-srcset']:
                             srcset = img_tag.get(srcset_attr)
                             if srcset:
                                 high_quality_url = parse_srcset(srcset)
                                 if high_quality_url:
-                                    return high_quality_url.strip()
+                                    return high_quality_url
                     return url.strip()
 
-        # Check parent picture element for source tags
-        if img_tag.parent and img_tag.parent.name == 'picture':
+        # Check parent picture element for source tags. libxml2 treats the
+        # HTML5 non-self-closed <source> as a container and nests the img
+        # (and later sources) inside it, so climb through any synthetic
+        # source levels before looking for the picture
+        parent = img_tag.parent
+        while parent is not None and parent.name == 'source':
+            parent = parent.parent
+        if parent is not None and parent.name == 'picture':
             best_source_url = None
             max_width = 0
 
-            for source in img_tag.parent.find_all('source'):
+            for source in parent.find_all('source'):
                 # Check srcset in source tags
                 srcset = source.get('srcset', '')
                 if srcset:
                     url = parse_srcset(srcset)
                     if url:
-                        # Try to get width from media query
-                        media = source.get('media', '')
-                        if 'min-width' in media:
-                            try:
-                                width = int(''.join(filter(str.isdigit, media)))
-                                if width > max_width:
-                                    max_width = width
-                                    best_source_url = url
-                            except ValueError:
-                                if not best_source_url:
-                                    best_source_url = url
-                        else:
-                            if not best_source_url:
+                        # Try to get width from the media query breakpoint;
+                        # the compiled regex picks out just the min-width
+                        # value instead of every digit in the query
+                        match = _MIN_WIDTH_RE.search(source.get('media', ''))
+                        if match:
+                            width = int(match.group(1))
+                            if width > max_width:
+                                max_width = width
                                 best_source_url = url
+                        elif not best_source_url:
+                            best_source_url = url
 
             if best_source_url:
-                return best_source_url.strip()
+                return best_source_url
 
         return None
 
-    def fix_url(self, url, base_url):
-        """Fix protocol-relative URLs and make relative URLs absolute"""
+    def fix_url(self, url, base_scheme, base_netloc, base_url):
+        """Fix protocol-relative URLs and make relative URLs absolute
+
+        The base is parsed once per page by the caller; the common prefixes
+        are handled with plain string concatenation, leaving urljoin only
+        for genuinely relative paths.
+        """
         try:
             if not url:
                 return None
 
-            # Handle protocol-relative URLs
-            if url.startswith('//'):
-                parsed_base = urlparse(base_url)
-                return f"{parsed_base.scheme}:{url}"
-
             # Handle data URLs
             if url.startswith('data:'):
                 return None
 
+            # Handle protocol-relative URLs
+            if url.startswith('//'):
+                return f"{base_scheme}:{url}"
+
+            # Handle root-relative URLs
+            if url.startswith('/'):
+                return f"{base_scheme}://{base_netloc}{url}"
+
+            if url.startswith(('http://', 'https://')):
+                return url
+
             return urljoin(base_url, url)
         except Exception as e:
             logger.error(f"Error fixing URL: {str(e)}")
             raise NetworkError(f"Invalid URL format: {str(e)}")
 
+    def _sniff_image(self, buf):
+        """Identify format and dimensions from container header bytes
+
+        One magic-byte dispatch answers both questions without a decode:
+        width and height live in the first few dozen bytes for PNG, GIF
+        and WebP and in the SOF marker for JPEG. Returns a (format,
+        dimensions) pair where either half is None when the header is
+        unrecognized or truncated, in which case callers fall back to PIL.
+        """
+        try:
+            if buf.startswith(b'\x89PNG\r\n\x1a\n'):
+                if len(buf) >= 24:
+                    # IHDR width/height, big-endian, at offset 16
+                    return 'png', (int.from_bytes(buf[16:20], 'big'),
+                                   int.from_bytes(buf[20:24], 'big'))
+                return 'png', None
+
+            if buf.startswith(b'\xff\xd8\xff'):
+                return 'jpeg', self._peek_jpeg_dimensions(buf)
+
+            if buf[:6] in (b'GIF87a', b'GIF89a'):
+                if len(buf) >= 10:
+                    # Logical screen descriptor, little-endian, at offset 6
+                    return 'gif', (int.from_bytes(buf[6:8], 'little'),
+                                   int.from_bytes(buf[8:10], 'little'))
+                return 'gif', None
+
+            if buf[:4] == b'RIFF' and buf[8:12] == b'WEBP':
+                return 'webp', self._peek_webp_dimensions(buf)
+        except (IndexError, ValueError):
+            pass
+        return None, None
+
+    def _peek_jpeg_dimensions(self, buf):
+        """Scan JPEG segments for the SOFn marker holding the frame size"""
+        i = 2
+        while i + 9 <= len(buf):
+            if buf[i] != 0xFF:
+                return None
+            marker = buf[i + 1]
+            # Skip padding bytes between segments
+            if marker == 0xFF:
+                i += 1
+                continue
+            # SOF0-SOF15 carry dimensions, except DHT/JPG/DAC (C4/C8/CC)
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                return (int.from_bytes(buf[i + 7:i + 9], 'big'),
+                        int.from_bytes(buf[i + 5:i + 7], 'big'))
+            i += 2 + int.from_bytes(buf[i + 2:i + 4], 'big')
+        return None
+
+    def _peek_webp_dimensions(self, buf):
+        """Read dimensions from a WebP VP8/VP8L/VP8X chunk header"""
+        chunk = buf[12:16]
+        if chunk == b'VP8X' and len(buf) >= 30:
+            return (int.from_bytes(buf[24:27], 'little') + 1,
+                    int.from_bytes(buf[27:30], 'little') + 1)
+        if chunk == b'VP8 ' and len(buf) >= 30 and buf[23:26] == b'\x9d\x01\x2a':
+            return (int.from_bytes(buf[26:28], 'little') & 0x3FFF,
+                    int.from_bytes(buf[28:30], 'little') & 0x3FFF)
+        if chunk == b'VP8L' and len(buf) >= 25 and buf[20] == 0x2F:
+            bits = int.from_bytes(buf[21:25], 'little')
+            return ((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+        return None
+
+    def _mmap_file(self, path):
+        """Map a file read-only so inspections are served by the page cache
+
+        The just-streamed bytes are still resident, so PIL and the hasher
+        read them without another userspace copy. mmap dups the descriptor,
+        so the opening file object can be closed immediately.
+        """
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _prewarm_dns(host):
+        """Resolve a host so the OS cache is warm for the fetches behind it
+
+        Failures are ignored here; a genuinely unresolvable host surfaces
+        as a download error on its own fetch.
+        """
+        try:
+            socket.getaddrinfo(host, 443)
+        except OSError:
+            pass
+
+    def _write_file(self, image_path, content):
+        """Write image bytes to disk (runs on the writer pool)
+
+        Writes through a raw fd: the body is already one bytes object, so
+        the buffered-IO layer would only add a copy between it and the
+        write(2) call.
+        """
+        fd = os.open(image_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            view = memoryview(content)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+
+    def _phash(self, source):
+        """64-bit difference hash of an image for near-duplicate detection
+
+        Compares adjacent pixels of a grayscale 9x8 thumbnail; identical
+        banners served at different srcset sizes land within a few bits of
+        each other. Accepts a filesystem path or a file-like object and
+        returns None when the bytes cannot be decoded.
+        """
+        try:
+            img = Image.open(source).convert('L').resize(
+                (9, 8), Image.BICUBIC)
+        except Exception as e:
+            logger.debug("Could not hash image: %s", e)
+            return None
+
+        pixels = list(img.getdata())
+        value = 0
+        for row in range(8):
+            for col in range(8):
+                value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+        return value
+
+    def _is_duplicate(self, source, seen_hashes, max_distance=4, min_signal_bits=4):
+        """Check an image against previously saved signatures
+
+        Gradient-bearing images compare by Hamming distance on the dHash.
+        Flat images are degenerate: any low-gradient image hashes to
+        (near) all-zero bits regardless of its colour, so the Hamming
+        rule would collapse distinct solid-background banners - exactly
+        this scraper's target content - into one. When the hash carries
+        almost no signal in either bit direction, the image is compared
+        by exact content digest instead. seen_hashes holds
+        (dhash, digest) pairs with exactly one half set, so the two
+        signature kinds never cross-match.
+        """
+        image_hash = self._phash(source)
+        if image_hash is None:
+            return False
+
+        bits = image_hash.bit_count()
+        if min(bits, 64 - bits) <= min_signal_bits:
+            source.seek(0)
+            digest = hashlib.sha256(source.read()).digest()
+            if any(prev_digest == digest for _, prev_digest in seen_hashes):
+                return True
+            seen_hashes.append((None, digest))
+            return False
+
+        for prev_hash, _ in seen_hashes:
+            if prev_hash is not None and \
+                    (image_hash ^ prev_hash).bit_count() <= max_distance:
+                return True
+        seen_hashes.append((image_hash, None))
+        return False
+
+    def _fetch_image(self, src, min_width, min_height, output_dir):
+        """Fetch an image in a single streaming pass
+
+        Reads the first 8 KB, sniffs dimensions and format from it, and
+        rejects undersized or disallowed images there and then - closing the
+        response discards the rest of the body without transferring it.
+        Accepted bodies continue streaming straight to a temp file in
+        output_dir, so the bytes are read off the wire exactly once.
+
+        Returns (head, content, tmp_path) where exactly one of content (the
+        whole body, when it fit in the head reads) and tmp_path is set, or
+        None when the head rejects the image.
+        """
+        response = self.session.get(src, timeout=10, stream=True)
+        response.raise_for_status()
+        with response:
+            # The response headers alone can disqualify the image before a
+            # single body byte is read
+            content_type = response.headers.get('Content-Type', '')
+            content_type = content_type.split(';', 1)[0].strip().lower()
+            if content_type.startswith('image/'):
+                if content_type[6:] not in self.allowed_formats:
+                    logger.debug("Skipping %s response for %s", content_type, src)
+                    return None
+            elif content_type.startswith('text/'):
+                # Error pages and soft 404s are never images
+                logger.debug("Skipping %s response for %s", content_type, src)
+                return None
+
+            content_length = response.headers.get('Content-Length', '')
+            if content_length.isdigit() and int(content_length) < 512:
+                # Too few bytes to hold a banner-sized image
+                logger.debug("Skipping %s-byte response for %s", content_length, src)
+                return None
+
+            response.raw.decode_content = True
+            head = response.raw.read(8192)
+
+            img_format, dimensions = self._sniff_image(head)
+            if dimensions and (dimensions[0] < min_width or dimensions[1] < min_height):
+                logger.debug("Skipping undersized image %s: %s", src, dimensions)
+                return None
+
+            if img_format is not None and img_format not in self.allowed_formats:
+                logger.debug("Skipping %s image %s", img_format, src)
+                return None
+
+            rest = response.raw.read(65536)
+            if not rest:
+                # Whole body fit in the head read; keep it in memory
+                return head, head, None
+
+            tmp = tempfile.NamedTemporaryFile(
+                delete=False, dir=output_dir, suffix='.part')
+            try:
+                with tmp:
+                    tmp.write(head)
+                    tmp.write(rest)
+                    shutil.copyfileobj(response.raw, tmp, length=65536)
+            except Exception:
+                os.unlink(tmp.name)
+                raise
+        return head, None, tmp.name
+
     def get_image_dimensions(self, content):
         """Get image dimensions from content"""
+        # Try the cheap header sniff first; it needs only the first few
+        # hundred bytes and no decoder
+        dimensions = self._sniff_image(content)[1]
+        if dimensions:
+            return dimensions
         try:
             img = Image.open(io.BytesIO(content))
             return img.size
@@ -290,107 +794,301 @@ class ImageScraper:
             logger.error(f"Error getting image dimensions: {str(e)}")
             raise ImageProcessingError(f"Failed to process image: {str(e)}")
 
+    def _save_if_accepted(self, result, src, matched_terms, min_width, min_height,
+                          output_dir, images, image_info, seen_hashes, write_futures):
+        """Validate one completed download and move it into the output folder
+
+        Runs the dimension, format and duplicate checks over the fetched
+        bytes and, on acceptance, places the image and records it in
+        images/image_info. Rejected temp files are always cleaned up.
+        """
+        head, content, tmp_path = result
+        source = None
+        saved = False
+        try:
+            # One read-only view over the full bytes for every fallback
+            # inspection: an mmap of the temp file (pages served straight
+            # from the cache) or the in-memory body
+            try:
+                source = self._mmap_file(tmp_path) if tmp_path \
+                    else io.BytesIO(content)
+            except (OSError, ValueError):
+                logger.warning(f"Failed to process image {src}")
+                return
+
+            # The head is usually enough for dimensions and format; one PIL
+            # open covers both fallbacks when the sniff comes up short
+            img_format, dimensions = self._sniff_image(head)
+            if dimensions is None or img_format is None:
+                try:
+                    source.seek(0)
+                    pil_img = Image.open(source)
+                    if dimensions is None:
+                        dimensions = pil_img.size
+                    if img_format is None:
+                        img_format = pil_img.format.lower() if pil_img.format else 'jpg'
+                except Exception:
+                    logger.warning(f"Failed to process image {src}")
+                    return
+
+            # Re-check against real dimensions now that we have bytes
+            if dimensions[0] < min_width or dimensions[1] < min_height:
+                return
+
+            # Skip unsupported formats
+            if img_format not in self.allowed_formats:
+                return
+
+            # Skip near-duplicates of images already saved (same banner at
+            # multiple srcset sizes, copied logos, ...)
+            source.seek(0)
+            if self._is_duplicate(source, seen_hashes):
+                logger.debug("Skipping duplicate image %s", src)
+                return
+
+            image_path = os.path.join(output_dir, f"image_{len(images)}.{img_format}")
+            if tmp_path:
+                # Body is already on disk; just move it into place
+                os.replace(tmp_path, image_path)
+                saved = True
+            else:
+                write_futures[
+                    self._writer_pool.submit(self._write_file, image_path, content)
+                ] = image_path
+
+            images.append(image_path)
+            image_info.append({
+                'path': image_path,
+                'matched_terms': matched_terms,
+                'format': img_format,
+                'dimensions': dimensions
+            })
+            logger.info(f"Saved image: {image_path}")
+        finally:
+            if source is not None:
+                source.close()
+            if tmp_path and not saved:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+
+    def _parse_candidates(self, response, page_url, rule, collect_attrs):
+        """Parse a page into unique (url, attribute-chains) candidates
+
+        Resolves each image tag to an absolute URL and deduplicates repeats
+        (logos, sprites and lazy-load fallbacks commonly reuse the same
+        URL), so each unique URL downloads exactly once. When collect_attrs
+        is set, every distinct referring tag's ancestor-chain token set is
+        kept, since any one of the referrers may be the one that satisfies
+        the term filters. The result holds no parse-tree references, so it
+        can outlive the soup and be cached per URL.
+        """
+        # Parse HTML; passing bytes lets the parser handle encoding
+        # detection natively. Term filters inspect ancestor attributes,
+        # so the full tree is only built when they are active; otherwise
+        # a strainer keeps the parse down to the image-bearing tags
+        if collect_attrs:
+            soup = BeautifulSoup(response.content, DEFAULT_PARSER)
+            img_tags = soup.find_all(['img', 'picture'])
+        elif HAS_SELECTOLAX:
+            # Lexbor enumerates the image tags faster still, with the
+            # adapter standing in for bs4 tags downstream
+            tree = LexborHTMLParser(response.text)
+            img_tags = [_NodeAdapter(node) for node in tree.css('img, picture')]
+        else:
+            soup = BeautifulSoup(response.content, DEFAULT_PARSER,
+                                 parse_only=_IMAGE_STRAINER)
+            img_tags = soup.find_all(['img', 'picture'])
+        if not img_tags:
+            raise ScraperError("No image tags found on the page")
+
+        logger.info(f"Found {len(img_tags)} total image tags")
+
+        # Parse the base URL once; every image on the page shares it
+        parsed_base = urlparse(page_url)
+        base_scheme, base_netloc = parsed_base.scheme, parsed_base.netloc
+
+        candidates = {}
+        for i, img_tag in enumerate(img_tags):
+            try:
+                # Get image source from various possible attributes
+                src = self.get_image_url(img_tag)
+                if not src:
+                    continue
+
+                # Fix and make URL absolute
+                src = self.fix_url(src, base_scheme, base_netloc, page_url)
+                if not src:
+                    continue
+
+                if not collect_attrs:
+                    candidates.setdefault(src, None)
+                    continue
+
+                all_attributes = rule._extract_all_attributes(img_tag)
+                attr_sets = candidates.get(src)
+                if attr_sets is None:
+                    candidates[src] = [all_attributes]
+                elif all_attributes not in attr_sets:
+                    # Same URL, different spot in the document
+                    attr_sets.append(all_attributes)
+            except Exception as e:
+                logger.error(f"Error resolving image {i}: {str(e)}")
+                continue
+        return list(candidates.items())
+
+    def _page_candidates(self, url, rule, collect_attrs):
+        """Fetch and parse a page, reusing cached candidates when unchanged
+
+        Re-scraping the same page is common (users tuning filter settings),
+        so parsed candidates are kept per URL and revalidated with a
+        conditional GET: a 304 skips both the transfer and the parse and
+        goes straight to the filter step. Attribute chains are
+        rule-independent (tokenization only reads class-level constants),
+        so an entry cached under one FilterRule serves any other - except
+        that unfiltered parses carry no chains and cannot serve a filtered
+        re-scrape.
+        """
+        cached = self._page_cache.get(url)
+        conditional = None
+        if cached is not None:
+            etag, last_modified, has_attrs, candidates = cached
+            if (has_attrs or not collect_attrs) and (etag or last_modified):
+                conditional = {}
+                if etag:
+                    conditional['If-None-Match'] = etag
+                if last_modified:
+                    conditional['If-Modified-Since'] = last_modified
+
+        try:
+            # The shared session reuses the pooled connection for the image
+            # fetches that follow; per-request headers merge on top of the
+            # session-wide ones
+            response = self.session.get(url, headers=conditional, timeout=30)
+            response.raise_for_status()
+        except Timeout:
+            raise NetworkError("Request timed out. The website might be slow or unavailable")
+        except ConnectionError:
+            raise NetworkError("Failed to connect to the website. Please check the URL and try again")
+        except RequestException as e:
+            raise NetworkError(f"Failed to fetch the webpage: {str(e)}")
+
+        if conditional is not None:
+            # Unchanged either via an explicit 304 or via requests-cache
+            # replaying the exact stored body we already parsed
+            unchanged = response.status_code == 304 or (
+                getattr(response, 'from_cache', False)
+                and response.headers.get('ETag') == etag
+                and response.headers.get('Last-Modified') == last_modified)
+            if unchanged:
+                logger.info(f"Page unchanged, reusing {len(candidates)} cached candidates")
+                return candidates
+
+        candidates = self._parse_candidates(response, url, rule, collect_attrs)
+        if url not in self._page_cache and \
+                len(self._page_cache) >= self._page_cache_size:
+            # Evict the oldest entry; dicts preserve insertion order
+            del self._page_cache[next(iter(self._page_cache))]
+        self._page_cache[url] = (response.headers.get('ETag'),
+                                 response.headers.get('Last-Modified'),
+                                 collect_attrs, candidates)
+        return candidates
+
     def scrape(self, url, output_dir, custom_rule=None):
         """Scrape images from URL"""
         images = []
         image_info = []
         try:
-            # Fetch the webpage
             logger.info(f"Scraping URL: {url}")
-            try:
-                response = requests.get(url, headers=self.headers, timeout=30)
-                response.raise_for_status()
-            except Timeout:
-                raise NetworkError("Request timed out. The website might be slow or unavailable")
-            except ConnectionError:
-                raise NetworkError("Failed to connect to the website. Please check the URL and try again")
-            except RequestException as e:
-                raise NetworkError(f"Failed to fetch the webpage: {str(e)}")
-
-            # Parse HTML
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # Find all image tags and source tags (for picture elements)
-            img_tags = soup.find_all(['img', 'picture'])
-            if not img_tags:
-                raise ScraperError("No image tags found on the page")
-
-            logger.info(f"Found {len(img_tags)} total image tags")
 
             # Use custom rule if provided, otherwise use default
             rule = custom_rule or FilterRule()
+            # id()-keyed entries must not leak across documents
+            rule._attr_cache.clear()
+            rule._chain_cache.clear()
+            need_attrs = bool(rule.include_terms or rule.exclude_terms)
 
-            for i, img in enumerate(img_tags):
-                try:
-                    # Get image source from various possible attributes
-                    src = self.get_image_url(img)
-                    if not src:
+            # First pass: resolve candidate URLs (cached per page) and apply
+            # the attribute-based filters, which need no bytes from the network
+            candidates = []
+            for src, attr_sets in self._page_candidates(url, rule, need_attrs):
+                if need_attrs:
+                    # A URL may be referenced from several places in the
+                    # document; the first referrer that passes the terms
+                    # wins. Dimensions are only known after download and
+                    # are checked then
+                    matched_terms = None
+                    for all_attributes in attr_sets:
+                        matches, terms = rule.matches_attributes(all_attributes)
+                        if matches:
+                            matched_terms = terms
+                            break
+                    if matched_terms is None:
+                        logger.debug("Image %s rejected by attribute filter", src)
                         continue
+                else:
+                    matched_terms = ['unfiltered']
+                candidates.append((src, matched_terms))
 
-                    # Fix and make URL absolute
-                    src = self.fix_url(src, url)
-                    if not src:
-                        continue
+            # Size thresholds used both by the download probe and the
+            # post-download re-check
+            if need_attrs:
+                min_width, min_height = rule.min_width, rule.min_height
+            else:
+                min_width = min_height = self.minimal_size
 
-                    logger.debug(f"Processing image {i}: {src}")
+            # Perceptual hashes of images saved so far, for duplicate detection
+            seen_hashes = []
+            # Pending disk writes, keyed by future so failures can be unwound
+            write_futures = {}
 
-                    # Download image
-                    try:
-                        img_response = requests.get(src, headers=self.headers, timeout=10)
-                        img_response.raise_for_status()
-                    except Exception as e:
-                        logger.warning(f"Failed to download image {src}: {str(e)}")
-                        continue
+            # Second pass: download candidates concurrently over the shared session
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, max(len(candidates), 1))) as pool:
+                # Queue a resolver warm-up per distinct host ahead of the
+                # fetches, so first contact with each CDN host does not
+                # serialize behind DNS
+                for host in {urlparse(src).hostname for src, _ in candidates}:
+                    if host:
+                        pool.submit(self._prewarm_dns, host)
 
-                    content = img_response.content
-                    try:
-                        dimensions = self.get_image_dimensions(content)
-                    except ImageProcessingError:
-                        logger.warning(f"Failed to process image {src}")
-                        continue
+                futures = {
+                    pool.submit(self._fetch_image, src, min_width, min_height, output_dir):
+                        (src, matched_terms)
+                    for src, matched_terms in candidates
+                }
 
-                    # Skip images smaller than minimal size when no filters
-                    if not rule.include_terms and not rule.exclude_terms:
-                        if dimensions[0] < self.minimal_size or dimensions[1] < self.minimal_size:
+                for future in as_completed(futures):
+                    src, matched_terms = futures[future]
+                    try:
+                        logger.debug("Processing image: %s", src)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            logger.warning(f"Failed to download image {src}: {str(e)}")
                             continue
 
-                    # Get image format and save
-                    img = Image.open(io.BytesIO(content))
-                    img_format = img.format.lower() if img.format else 'jpg'
-
-                    # Skip unsupported formats
-                    if img_format not in self.allowed_formats:
-                        continue
-
-                    # Apply filtering rules if they exist
-                    if rule.include_terms or rule.exclude_terms:
-                        all_attributes = self._extract_all_attributes(img)
-                        matches, matched_terms = rule.matches(img, dimensions, all_attributes)
-                        if not matches:
+                        if result is None:
+                            # Rejected during the header sniff
                             continue
-                    else:
-                        matched_terms = ['unfiltered']
 
-                    image_path = os.path.join(output_dir, f"image_{len(images)}.{img_format}")
-                    try:
-                        with open(image_path, 'wb') as f:
-                            f.write(content)
-                    except IOError as e:
-                        logger.error(f"Failed to save image: {str(e)}")
+                        self._save_if_accepted(
+                            result, src, matched_terms, min_width, min_height,
+                            output_dir, images, image_info, seen_hashes,
+                            write_futures)
+
+                    except Exception as e:
+                        logger.error(f"Error processing image {src}: {str(e)}")
                         continue
 
-                    images.append(image_path)
-                    image_info.append({
-                        'path': image_path,
-                        'matched_terms': matched_terms,
-                        'format': img_format,
-                        'dimensions': dimensions
-                    })
-                    logger.info(f"Saved image: {image_path}")
-
-                except Exception as e:
-                    logger.error(f"Error processing image {i}: {str(e)}")
-                    continue
+            # All writes must land before results are reported
+            wait(write_futures)
+            for future, image_path in write_futures.items():
+                error = future.exception()
+                if error is not None:
+                    logger.error(f"Failed to save image: {str(error)}")
+                    images = [path for path in images if path != image_path]
+                    image_info = [info for info in image_info if info['path'] != image_path]
 
             if not images:
                 if rule.include_terms or rule.exclude_terms: